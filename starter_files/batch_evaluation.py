@@ -5,19 +5,36 @@ Batch Evaluation Script for NASA RAG System
 
 import os
 import json
-import statistics
+import math
+import argparse
+import asyncio
+import functools
+import time
+from collections import defaultdict
 from pathlib import Path
-from typing import List, Dict
+from typing import List, Dict, Optional
 
 import rag_client
 import llm_client
 import ragas_evaluator
 
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
 # ===================== CONFIG =====================
 SCRIPT_DIR = Path(__file__).parent
 TEST_QUESTIONS_FILE = SCRIPT_DIR / "test_questions.json"  # ensure correct path
+RESULTS_FILE = SCRIPT_DIR / "batch_evaluation_results.json"  # aggregate metrics
+PER_QUESTION_FILE = SCRIPT_DIR / "batch_evaluation_results.jsonl"  # one record per line
 N_RESULTS = 3
 MODEL_NAME = "gpt-3.5-turbo"
+MAX_CONCURRENCY = 10  # questions in flight at once
+REQUESTS_PER_MIN = 3000  # local budgets, keep below the account's OpenAI limits
+TOKENS_PER_MIN = 150000
+RAGAS_CONCURRENCY = 4  # RAGAS makes several LLM calls per sample, so cap it separately
 
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 if not OPENAI_API_KEY:
@@ -29,24 +46,63 @@ def load_test_questions(path: Path) -> List[Dict]:
     """Load JSON test questions"""
     if not path.exists():
         raise FileNotFoundError(f"Test questions file not found: {path}")
-    with open(path, "r", encoding="utf-8") as f:
-        questions = json.load(f)
+    if ORJSON_AVAILABLE:
+        with open(path, "rb") as f:
+            questions = orjson.loads(f.read())
+    else:
+        with open(path, "r", encoding="utf-8") as f:
+            questions = json.load(f)
     if len(questions) < 5:
         raise ValueError("Evaluation dataset must contain at least 5 questions")
     return questions
 
-def aggregate_metrics(results: List[Dict]) -> Dict[str, float]:
-    """Compute mean score per metric"""
-    aggregates = {}
-    for result in results:
-        for metric, value in result.get("metrics", {}).items():
-            if isinstance(value, (int, float)):
-                aggregates.setdefault(metric, []).append(value)
-    return {metric: statistics.mean(vals) for metric, vals in aggregates.items() if vals}
+def drop_non_finite(data):
+    """Replace NaN/inf floats with None so orjson and json write the same output"""
+    if isinstance(data, float) and not math.isfinite(data):
+        return None
+    if isinstance(data, dict):
+        return {key: drop_non_finite(value) for key, value in data.items()}
+    if isinstance(data, (list, tuple)):
+        return [drop_non_finite(value) for value in data]
+    return data
+
+def save_json(data, path: Path):
+    """Write JSON with orjson when available, falling back to the stdlib"""
+    data = drop_non_finite(data)
+    if ORJSON_AVAILABLE:
+        with open(path, "wb") as f:
+            f.write(orjson.dumps(data, option=orjson.OPT_INDENT_2))
+    else:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2)
+
+def dumps_line(record: Dict) -> bytes:
+    """Serialize one record as a JSON Lines entry"""
+    record = drop_non_finite(record)
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(record) + b"\n"
+    return (json.dumps(record) + "\n").encode("utf-8")
+
+def accumulate_metrics(sums: Dict[str, float], counts: Dict[str, int], metrics: Dict):
+    """Add one result's finite numeric metrics to running sums and counts"""
+    for metric, value in metrics.items():
+        # NaN scores stay in the per-question record but not in the mean
+        if isinstance(value, (int, float)) and math.isfinite(value):
+            sums[metric] += value
+            counts[metric] += 1
+
+def mean_metrics(sums: Dict[str, float], counts: Dict[str, int]) -> Dict[str, float]:
+    """Turn running sums and counts into a mean per metric"""
+    return {metric: sums[metric] / counts[metric] for metric in sums}
+
+async def run_in_thread(func, *args, **kwargs):
+    """Run a blocking call in the default executor"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, functools.partial(func, *args, **kwargs))
 
 
 # ===================== MAIN =====================
-def main():
+async def main(use_batch_api: bool = False):
     print("🚀 Starting batch evaluation")
 
     questions = load_test_questions(TEST_QUESTIONS_FILE)
@@ -59,61 +115,178 @@ def main():
     backend = list(backends.values())[0]
     print(f"Using backend: {backend['display_name']}")
 
-    collection = rag_client.initialize_rag_system(backend["path"], backend["collection"])
+    collection = rag_client.initialize_rag_system(
+        backend["path"], backend["collection"], api_key=OPENAI_API_KEY
+    )
 
-    per_question_results = []
+    # Only running sums are kept in memory; records are streamed to disk
+    sums: Dict[str, float] = defaultdict(float)
+    counts: Dict[str, int] = defaultdict(int)
 
-    conversation_history: List[Dict] = []
+    # Identical questions are answered once, then fanned back out to every
+    # original position
+    positions: Dict[str, List[int]] = {}
+    for idx, item in enumerate(questions):
+        positions.setdefault(item["question"], []).append(idx)
+    unique_questions = list(positions)
+    if len(unique_questions) < len(questions):
+        print(f"Evaluating {len(unique_questions)} unique questions")
 
-    for idx, item in enumerate(questions, start=1):
-        question = item["question"]
-        print(f"\n🔍 Question {idx}: {question}")
+    def question_label(question: str) -> str:
+        # Number by dataset position, listing every position a duplicate fills
+        numbers = ", ".join(str(idx + 1) for idx in positions[question])
+        return f"Question {numbers}"
 
-        retrieval = rag_client.retrieve_documents(collection, question, n_results=N_RESULTS)
-        documents = retrieval.get("documents", [[]])[0]
-        metadatas = retrieval.get("metadatas", [[]])[0]
-        context = rag_client.format_context(documents, metadatas)
+    def write_result(record: Dict):
+        for idx in positions[record["question"]]:
+            results_file.write(dumps_line({"index": idx, **record}))
+            accumulate_metrics(sums, counts, record["metrics"])
 
-        answer = llm_client.generate_response(
-            openai_key=OPENAI_API_KEY,
-            user_message=question,
-            context=context,
-            conversation_history=conversation_history,
-            model=MODEL_NAME
-        )
+    dispatcher = llm_client.ThrottledDispatcher(
+        requests_per_min=REQUESTS_PER_MIN,
+        tokens_per_min=TOKENS_PER_MIN,
+        max_workers=MAX_CONCURRENCY,
+        model=MODEL_NAME
+    )
+    ragas_sem = asyncio.Semaphore(RAGAS_CONCURRENCY)
+    # One set of RAGAS metrics (and their OpenAI clients) shared by every question
+    ragas_metrics = ragas_evaluator.build_metrics() if ragas_evaluator.RAGAS_AVAILABLE else None
 
-        # Update conversation history
-        conversation_history.append({"role": "user", "content": question})
-        conversation_history.append({"role": "assistant", "content": answer})
+    # Retrieve contexts for every question in one Chroma round-trip
+    retrievals = rag_client.retrieve_documents_batch(
+        collection, unique_questions, n_results=N_RESULTS
+    )
+    retrieved = []
+    for retrieval in retrievals:
+        documents = retrieval.get("documents", [[]])[0]
+        metadatas = retrieval.get("metadatas", [[]])[0]
+        retrieved.append((documents, rag_client.format_context(documents, metadatas)))
 
-        try:
-            metrics = ragas_evaluator.evaluate_response_quality(
-                question=question,
-                answer=answer,
-                contexts=documents
-            )
-        except Exception as e:
-            metrics = {"error": str(e)}
+    async def score_answer(question: str, answer: str, documents: List[str],
+                           first_token_seconds: Optional[float] = None):
+        async with ragas_sem:
+            try:
+                metrics = await ragas_evaluator.aevaluate_response_quality(
+                    question=question,
+                    answer=answer,
+                    contexts=documents,
+                    metrics=ragas_metrics
+                )
+            except Exception as e:
+                metrics = {"error": str(e)}
 
-        per_question_results.append({
+        record = {
             "question": question,
             "answer": answer,
             "metrics": metrics
-        })
+        }
+        if first_token_seconds is not None:
+            record["first_token_seconds"] = first_token_seconds
+        write_result(record)
 
+        print(f"\n🔍 {question_label(question)}: {question}")
+        if first_token_seconds is not None:
+            print(f"First token after {first_token_seconds:.2f}s")
         print("Metrics:", metrics)
 
-    aggregate = aggregate_metrics(per_question_results)
+    def record_unanswered(question: str):
+        # Nothing was retrieved, so there is no answer worth an LLM or RAGAS call
+        write_result({
+            "question": question,
+            "answer": llm_client.NO_CONTEXT_ANSWER,
+            "metrics": {}
+        })
+
+        print(f"\n🔍 {question_label(question)}: {question}")
+        print("No documents retrieved, skipped evaluation")
+
+    def record_failed(question: str, error: str):
+        # The answer request itself failed, so there is nothing to score
+        write_result({
+            "question": question,
+            "answer": None,
+            "metrics": {},
+            "error": error
+        })
+
+        print(f"\n🔍 {question_label(question)}: {question}")
+        print("Answer generation failed:", error)
+
+    async def process(idx: int, question: str):
+        documents, context = retrieved[idx]
+        if not context.strip():
+            record_unanswered(question)
+            return
+
+        timing: Dict[str, float] = {}
+
+        async def generate() -> str:
+            # Timed from when the dispatcher starts the job, not from queueing
+            started = time.monotonic()
+
+            def first_token():
+                timing["first_token_seconds"] = time.monotonic() - started
+
+            # Questions are independent, so each one starts with an empty history
+            return await llm_client.agenerate_response(
+                openai_key=OPENAI_API_KEY,
+                user_message=question,
+                context=context,
+                conversation_history=[],
+                model=MODEL_NAME,
+                on_first_token=first_token
+            )
+
+        try:
+            answer = await dispatcher.submit(generate, prompt=llm_client.prompt_text(question, context, []))
+        except Exception as e:
+            record_failed(question, str(e))
+            return
+
+        # Score after the dispatcher releases its worker so the next answer can start
+        await score_answer(question, answer, documents, timing.get("first_token_seconds"))
+
+    with open(PER_QUESTION_FILE, "wb") as results_file:
+        if use_batch_api:
+            print("Submitting answers through the OpenAI Batch API (this may take a while)")
+            answers, errors = await run_in_thread(
+                llm_client.submit_batch,
+                OPENAI_API_KEY,
+                unique_questions,
+                [context for _, context in retrieved],
+                MODEL_NAME
+            )
+            scoring = []
+            for idx, question in enumerate(unique_questions):
+                documents, context = retrieved[idx]
+                if not context.strip():
+                    record_unanswered(question)
+                elif str(idx) in errors:
+                    record_failed(question, errors[str(idx)])
+                else:
+                    scoring.append(score_answer(question, answers[str(idx)], documents))
+            await asyncio.gather(*scoring)
+        else:
+            try:
+                await asyncio.gather(*[process(idx, q) for idx, q in enumerate(unique_questions)])
+            finally:
+                await dispatcher.close()
+
+    aggregate = mean_metrics(sums, counts)
     print("\n📊 Aggregate Metrics")
     for metric, score in aggregate.items():
         print(f"{metric}: {score:.4f}")
 
-    # Save results
-    with open(SCRIPT_DIR / "batch_evaluation_results.json", "w", encoding="utf-8") as f:
-        json.dump({"per_question": per_question_results, "aggregate": aggregate}, f, indent=2)
+    # Per-question records are already in PER_QUESTION_FILE
+    save_json({"aggregate": aggregate, "per_question_file": PER_QUESTION_FILE.name}, RESULTS_FILE)
+    print(f"Per-question results written to {PER_QUESTION_FILE}")
 
     print("\n✅ Batch evaluation complete")
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Batch evaluation for the NASA RAG system")
+    parser.add_argument("--batch-api", action="store_true",
+                        help="Generate answers with the OpenAI Batch API instead of live requests")
+    args = parser.parse_args()
+    asyncio.run(main(use_batch_api=args.batch_api))
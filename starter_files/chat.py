@@ -39,11 +39,11 @@ def discover_chroma_backends() -> Dict[str, Dict[str, str]]:
     return rag_client.discover_chroma_backends()
 
 #@st.cache_resource
-def initialize_rag_system(chroma_dir: str, collection_name: str):
+def initialize_rag_system(chroma_dir: str, collection_name: str, openai_key: Optional[str] = None):
     """Initialize the RAG system with specified backend (cached for performance)"""
 
     try:
-       return rag_client.initialize_rag_system(chroma_dir, collection_name)
+       return rag_client.initialize_rag_system(chroma_dir, collection_name, openai_key)
     except Exception as e:
         return None, False, str(e)
 
@@ -110,6 +110,8 @@ def main():
     # Initialize session state
     if "messages" not in st.session_state:
         st.session_state.messages = []
+    if "history" not in st.session_state:
+        st.session_state.history = llm_client.new_history()
     if "current_backend" not in st.session_state:
         st.session_state.current_backend = None
     if "last_evaluation" not in st.session_state:
@@ -184,7 +186,8 @@ def main():
 
         collection, success, error = initialize_rag_system(
             selected_backend["directory"], 
-            selected_backend["collection_name"]
+            selected_backend["collection_name"],
+            openai_key
         )
     
     if not success:
@@ -230,7 +233,7 @@ def main():
                     openai_key, 
                     prompt, 
                     context, 
-                    st.session_state.messages[:-1],
+                    st.session_state.history,
                     model_choice
                 )
                 st.markdown(response)
@@ -247,6 +250,8 @@ def main():
         
         # Add assistant response to chat history
         st.session_state.messages.append({"role": "assistant", "content": response})
+        llm_client.add_to_history(st.session_state.history, "user", prompt)
+        llm_client.add_to_history(st.session_state.history, "assistant", response)
         st.rerun()
 
 
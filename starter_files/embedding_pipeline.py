@@ -19,7 +19,6 @@ import logging
 from pathlib import Path
 from typing import Dict, List, Any, Optional, Tuple
 import chromadb
-from chromadb.config import Settings
 import openai
 from openai import OpenAI
 import hashlib
@@ -68,9 +67,7 @@ class ChromaEmbeddingPipelineTextOnly:
         self.chunk_overlap= overlap
         # TODO: Initialize ChromaDB client
 
-        self.chroma_client= chroma_db.Client(
-            Settings(persist_directory=chroma_persist_directory)
-        )
+        self.chroma_client= chromadb.PersistentClient(path=chroma_persist_directory)
         # TODO: Create or get collection
 
         self.collection=self.chroma_client.get_or_create_collection(name=collection_name)
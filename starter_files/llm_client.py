@@ -1,38 +1,74 @@
 # llm_client.py
-from typing import List, Dict
-from openai import OpenAI
+import json
+import time
+import asyncio
+import functools
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, List, Dict, Optional, Tuple, Union
+import httpx
+from openai import OpenAI, AsyncOpenAI
+
+try:
+    import tiktoken
+    TIKTOKEN_AVAILABLE = True
+except ImportError:
+    TIKTOKEN_AVAILABLE = False
 
 MAX_HISTORY_TURNS = 5  # only keep last N turns to prevent unbounded growth
+MAX_COMPLETION_TOKENS = 600
+NO_CONTEXT_ANSWER = "I don't know based on the provided documents."
+BATCH_POLL_INTERVAL = 30  # seconds between Batch API status checks
+BATCH_TERMINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+HTTP_LIMITS = httpx.Limits(max_connections=64, max_keepalive_connections=32)
 
-def generate_response(
-    openai_key: str,
+# === SYSTEM PROMPT ===
+SYSTEM_PROMPT = (
+    "You are a NASA mission expert specializing in space missions, "
+    "spacecraft, astronomy, and planetary science.\n\n"
+    "Rules:\n"
+    "- Use ONLY the provided context to answer the question.\n"
+    "- Cite sources using the format [DOC_ID] after each factual claim.\n"
+    "- If the answer is not in the context, say 'I don't know based on the provided documents.'\n"
+    "- Do NOT use outside knowledge.\n"
+    "- Keep answers clear, concise, and educational."
+)
+_SYSTEM_MSG = {"role": "system", "content": SYSTEM_PROMPT}
+
+@functools.lru_cache(maxsize=4)
+def _client(openai_key: str) -> OpenAI:
+    """Shared client per API key, so calls reuse pooled connections"""
+    return OpenAI(api_key=openai_key)
+
+@functools.lru_cache(maxsize=4)
+def _async_client(openai_key: str) -> AsyncOpenAI:
+    """Shared async client per API key, so calls reuse pooled connections"""
+    return AsyncOpenAI(api_key=openai_key, http_client=httpx.AsyncClient(limits=HTTP_LIMITS))
+
+def new_history() -> Deque[Dict]:
+    """Conversation history bounded to the last MAX_HISTORY_TURNS turns"""
+    return deque(maxlen=MAX_HISTORY_TURNS*2)  # each turn = user + assistant
+
+def add_to_history(history: Deque[Dict], role: str, content: Optional[str]):
+    """Validate a message once and append it to the history"""
+    if content is None:  # completions can come back without content
+        content = ""
+    if role not in ("user", "assistant") or not isinstance(content, str):
+        raise ValueError(f"Invalid history message with role '{role}'")
+    history.append({"role": role, "content": content})
+
+def _build_messages(
     user_message: str,
     context: str,
-    conversation_history: List[Dict],
-    model: str = "gpt-3.5-turbo"
-) -> str:
+    conversation_history: Union[Deque[Dict], List[Dict]]
+) -> List[Dict]:
     """
-    Generate a NASA mission expert response using OpenAI, grounded in retrieved context.
-    Maintains conversation history and prunes it to last MAX_HISTORY_TURNS.
+    Build the chat message list: system prompt, optional context,
+    pruned conversation history and the current user message.
+    History entries are expected to be {"role", "content"} dicts already.
     """
 
-    # === SYSTEM PROMPT ===
-    system_prompt = (
-        "You are a NASA mission expert specializing in space missions, "
-        "spacecraft, astronomy, and planetary science.\n\n"
-        "Rules:\n"
-        "- Use ONLY the provided context to answer the question.\n"
-        "- Cite sources using the format [DOC_ID] after each factual claim.\n"
-        "- If the answer is not in the context, say 'I don't know based on the provided documents.'\n"
-        "- Do NOT use outside knowledge.\n"
-        "- Keep answers clear, concise, and educational."
-    )
-
-    # === CREATE OPENAI CLIENT ===
-    client = OpenAI(api_key=openai_key)
-
     # === BUILD MESSAGE HISTORY ===
-    messages: List[Dict] = [{"role": "system", "content": system_prompt}]
+    messages: List[Dict] = [_SYSTEM_MSG]
 
     # Add context as system message
     if context:
@@ -42,21 +78,289 @@ def generate_response(
         })
 
     # Prune conversation history to last N turns
-    history_to_use = conversation_history[-MAX_HISTORY_TURNS*2:]  # each turn = user + assistant
-
-    for msg in history_to_use:
-        if "role" in msg and "content" in msg:
-            messages.append(msg)
+    # Deques from new_history() are already bounded; anything else is sliced
+    maxlen = getattr(conversation_history, "maxlen", None)
+    if maxlen is None or maxlen > MAX_HISTORY_TURNS*2:
+        conversation_history = list(conversation_history)[-MAX_HISTORY_TURNS*2:]  # each turn = user + assistant
+    messages.extend(conversation_history)
 
     # Add current user message
     messages.append({"role": "user", "content": user_message})
 
+    return messages
+
+def generate_response(
+    openai_key: str,
+    user_message: str,
+    context: str,
+    conversation_history: Union[Deque[Dict], List[Dict]],
+    model: str = "gpt-3.5-turbo"
+) -> str:
+    """
+    Generate a NASA mission expert response using OpenAI, grounded in retrieved context.
+    Maintains conversation history and prunes it to last MAX_HISTORY_TURNS.
+    """
+
+    # Nothing retrieved: the rules force this answer, so skip the API call
+    if not context.strip():
+        return NO_CONTEXT_ANSWER
+
+    # === GET SHARED OPENAI CLIENT ===
+    client = _client(openai_key)
+
+    messages = _build_messages(user_message, context, conversation_history)
+
     # === CALL OPENAI ===
     response = client.chat.completions.create(
         model=model,
         messages=messages,
         temperature=0.3,
-        max_tokens=600
+        max_tokens=MAX_COMPLETION_TOKENS
     )
 
     return response.choices[0].message.content
+
+async def agenerate_response(
+    openai_key: str,
+    user_message: str,
+    context: str,
+    conversation_history: Union[Deque[Dict], List[Dict]],
+    model: str = "gpt-3.5-turbo",
+    on_first_token: Optional[Callable[[], None]] = None
+) -> str:
+    """
+    Async variant of generate_response, so independent questions can be
+    answered concurrently. The completion is streamed; on_first_token, if
+    given, is called as soon as the first content arrives.
+    """
+
+    # Nothing retrieved: the rules force this answer, so skip the API call
+    if not context.strip():
+        return NO_CONTEXT_ANSWER
+
+    # === GET SHARED OPENAI CLIENT ===
+    client = _async_client(openai_key)
+
+    messages = _build_messages(user_message, context, conversation_history)
+
+    # === CALL OPENAI (STREAMING) ===
+    response = await client.chat.completions.create(
+        model=model,
+        messages=messages,
+        temperature=0.3,
+        max_tokens=MAX_COMPLETION_TOKENS,
+        stream=True
+    )
+
+    pieces: List[str] = []
+    async for chunk in response:
+        if not chunk.choices:
+            continue
+        piece = chunk.choices[0].delta.content
+        if piece:
+            if not pieces and on_first_token is not None:
+                on_first_token()
+            pieces.append(piece)
+
+    return "".join(pieces)
+
+def submit_batch(
+    openai_key: str,
+    questions: List[str],
+    contexts: List[str],
+    model: str = "gpt-3.5-turbo",
+    poll_interval: float = BATCH_POLL_INTERVAL
+) -> Tuple[Dict[str, str], Dict[str, str]]:
+    """
+    Answer many questions through the OpenAI Batch API (cheaper, higher
+    throughput, but not interactive). Blocks until the batch finishes.
+    Returns (answers, errors), both keyed by custom_id (the question index).
+    Requests that failed or got no response are reported in errors.
+    Questions with an empty context are answered locally with NO_CONTEXT_ANSWER.
+    """
+    # Questions without context get the canned answer instead of a request
+    answers: Dict[str, str] = {}
+    errors: Dict[str, str] = {}
+    submitted: List[str] = []
+
+    # === BUILD JSONL REQUESTS ===
+    lines = []
+    for i, (question, context) in enumerate(zip(questions, contexts)):
+        if not context.strip():
+            answers[str(i)] = NO_CONTEXT_ANSWER
+            continue
+        submitted.append(str(i))
+        lines.append(json.dumps({
+            "custom_id": str(i),
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": {
+                "model": model,
+                "messages": _build_messages(question, context, []),
+                "temperature": 0.3,
+                "max_tokens": MAX_COMPLETION_TOKENS
+            }
+        }))
+
+    if not lines:
+        return answers, errors
+
+    client = _client(openai_key)
+
+    # === UPLOAD AND SUBMIT ===
+    batch_file = client.files.create(
+        file=("batch_requests.jsonl", "\n".join(lines).encode("utf-8")),
+        purpose="batch"
+    )
+    batch = client.batches.create(
+        input_file_id=batch_file.id,
+        endpoint="/v1/chat/completions",
+        completion_window="24h"
+    )
+
+    # === POLL UNTIL DONE ===
+    while batch.status not in BATCH_TERMINAL_STATUSES:
+        time.sleep(poll_interval)
+        batch = client.batches.retrieve(batch.id)
+
+    # === COLLECT ANSWERS AND ERRORS ===
+    # Expired or cancelled batches may still carry partial results, so read
+    # whatever files exist and report the rest as missing
+    for file_id in (batch.output_file_id, batch.error_file_id):
+        if not file_id:
+            continue
+        for line in client.files.content(file_id).text.splitlines():
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            custom_id = record["custom_id"]
+            response = record.get("response") or {}
+            if response.get("status_code") == 200:
+                content = response["body"]["choices"][0]["message"]["content"]
+                if content is None:
+                    errors[custom_id] = "Completion returned no content"
+                else:
+                    answers[custom_id] = content
+                continue
+            error = record.get("error") or (response.get("body") or {}).get("error")
+            if isinstance(error, dict):
+                error = error.get("message") or json.dumps(error)
+            errors[custom_id] = str(error or f"HTTP {response.get('status_code')}")
+
+    for custom_id in submitted:
+        if custom_id not in answers and custom_id not in errors:
+            errors[custom_id] = f"No response in batch output (batch {batch.id} {batch.status})"
+
+    return answers, errors
+
+def prompt_text(
+    user_message: str,
+    context: str,
+    conversation_history: Union[Deque[Dict], List[Dict]]
+) -> str:
+    """Full text of the messages sent for a request, for token estimates"""
+    messages = _build_messages(user_message, context, conversation_history)
+    return "\n".join(message["content"] for message in messages)
+
+def estimate_tokens(text: str, model: str = "gpt-3.5-turbo") -> int:
+    """Estimate prompt tokens, falling back to ~4 chars/token without tiktoken"""
+    if TIKTOKEN_AVAILABLE:
+        try:
+            return len(tiktoken.encoding_for_model(model).encode(text))
+        except Exception:
+            # Unknown model, or the BPE file could not be downloaded (offline)
+            pass
+    return len(text) // 4 + 1
+
+class ThrottledDispatcher:
+    """
+    Dispatch async OpenAI jobs from a queue through a worker pool, only
+    starting a job once the local request and token budgets allow it, so
+    parallel runs stay under the rate limits instead of retrying on 429s.
+    """
+
+    def __init__(
+        self,
+        requests_per_min: float,
+        tokens_per_min: float,
+        max_workers: int = 10,
+        model: str = "gpt-3.5-turbo"
+    ):
+        self.requests_per_min = requests_per_min
+        self.tokens_per_min = tokens_per_min
+        self.max_workers = max_workers
+        self.model = model
+
+        self._available_requests = requests_per_min
+        self._available_tokens = tokens_per_min
+        self._last_refill = time.monotonic()
+        self._budget_lock: Optional[asyncio.Lock] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self._last_refill
+        self._last_refill = now
+        self._available_requests = min(
+            self.requests_per_min,
+            self._available_requests + elapsed * self.requests_per_min / 60
+        )
+        self._available_tokens = min(
+            self.tokens_per_min,
+            self._available_tokens + elapsed * self.tokens_per_min / 60
+        )
+
+    async def _acquire(self, tokens: int):
+        # A single job larger than the whole bucket would never fit; cap it
+        tokens = min(tokens, self.tokens_per_min)
+        async with self._budget_lock:
+            while True:
+                self._refill()
+                if self._available_requests >= 1 and self._available_tokens >= tokens:
+                    self._available_requests -= 1
+                    self._available_tokens -= tokens
+                    return
+                request_wait = (1 - self._available_requests) * 60 / self.requests_per_min
+                token_wait = (tokens - self._available_tokens) * 60 / self.tokens_per_min
+                await asyncio.sleep(max(request_wait, token_wait, 0.001))
+
+    async def _worker(self):
+        while True:
+            job, tokens, future = await self._queue.get()
+            try:
+                await self._acquire(tokens)
+                result = await job()
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+            else:
+                if not future.done():
+                    future.set_result(result)
+            finally:
+                self._queue.task_done()
+
+    def _start(self):
+        if self._workers:
+            return
+        self._budget_lock = asyncio.Lock()
+        self._queue = asyncio.Queue()
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.max_workers)]
+
+    async def submit(self, job: Callable[[], Awaitable[Any]], prompt: str) -> Any:
+        """
+        Queue a job (a zero-argument coroutine function) and wait for its result.
+        The prompt text is used to estimate the job's token cost.
+        """
+        self._start()
+        tokens = estimate_tokens(prompt, self.model) + MAX_COMPLETION_TOKENS
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((job, tokens, future))
+        return await future
+
+    async def close(self):
+        """Stop the worker pool"""
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
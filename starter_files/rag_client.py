@@ -1,12 +1,57 @@
 # rag_client.py
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Tuple
 from pathlib import Path
+from collections import OrderedDict
+import copy
+import functools
+import hashlib
+import shelve
+import threading
 import chromadb
 from chromadb.utils import embedding_functions
 
 # ------------------ CONFIG ------------------
 DEFAULT_CHROMA_DIR = Path("chroma_db")
 DEFAULT_COLLECTION_NAME = "nasa_missions"
+EMBEDDING_MODEL = "text-embedding-3-small"
+EMBEDDING_CACHE_FILE = "embedding_cache"  # shelve file inside the chroma directory
+RETRIEVAL_CACHE_SIZE = 2048
+
+# ------------------ EMBEDDING CACHE ------------------
+
+class CachedEmbeddingFunction:
+    """
+    Chroma embedding function that persists embeddings on disk, keyed by
+    sha256(model + text), so repeated queries skip the OpenAI round-trip.
+    """
+
+    def __init__(self, cache_path: str, model_name: str = EMBEDDING_MODEL, api_key: Optional[str] = None):
+        self.cache_path = cache_path
+        self.model_name = model_name
+        self._embed = embedding_functions.OpenAIEmbeddingFunction(
+            api_key=api_key, model_name=model_name
+        )
+        self._lock = threading.Lock()
+
+    def _key(self, text: str) -> str:
+        return hashlib.sha256((self.model_name + text).encode("utf-8")).hexdigest()
+
+    def __call__(self, input: List[str]) -> List[List[float]]:
+        keys = [self._key(text) for text in input]
+
+        with self._lock, shelve.open(self.cache_path) as cache:
+            embeddings = [cache.get(key) for key in keys]
+
+        missing = [i for i, vec in enumerate(embeddings) if vec is None]
+        if missing:
+            fresh = self._embed([input[i] for i in missing])
+            with self._lock, shelve.open(self.cache_path) as cache:
+                for i, vec in zip(missing, fresh):
+                    vec = [float(x) for x in vec]
+                    cache[keys[i]] = vec
+                    embeddings[i] = vec
+
+        return embeddings
 
 # ------------------ BACKEND DISCOVERY ------------------
 
@@ -31,53 +76,94 @@ def discover_chroma_backends(chroma_dir: Optional[Path] = None) -> Dict[str, Dic
 
 # ------------------ RAG SYSTEM INITIALIZATION ------------------
 
-def initialize_rag_system(chroma_dir: str, collection_name: str):
+@functools.lru_cache(maxsize=8)
+def initialize_rag_system(chroma_dir: str, collection_name: str, api_key: Optional[str] = None):
     """
     Initialize Chroma collection for NASA RAG system.
+    api_key is the OpenAI key for query embeddings; when omitted Chroma
+    falls back to the CHROMA_OPENAI_API_KEY environment variable.
+    Cached per (chroma_dir, collection_name, api_key) so repeat calls reuse the client;
+    call initialize_rag_system.cache_clear() to force reinitialization.
     """
-    client = chromadb.Client(chromadb.config.Settings(
-        chroma_db_impl="duckdb+parquet",
-        persist_directory=chroma_dir
-    ))
+    client = chromadb.PersistentClient(path=str(chroma_dir))
+
+    embedding_function = CachedEmbeddingFunction(
+        str(Path(chroma_dir) / EMBEDDING_CACHE_FILE), api_key=api_key
+    )
 
     if collection_name in [c.name for c in client.list_collections()]:
-        collection = client.get_collection(collection_name)
+        collection = client.get_collection(collection_name, embedding_function=embedding_function)
     else:
         collection = client.create_collection(
             name=collection_name,
-            embedding_function=embedding_functions.OpenAIEmbeddingFunction(
-                api_key=None, model_name="text-embedding-3-small"
-            )
+            embedding_function=embedding_function
         )
 
     return collection
 
 # ------------------ DOCUMENT RETRIEVAL ------------------
 
+# In-process LRU of query results, keyed by (collection id, query, n_results).
+# Entries are copied in and out, so callers may mutate what they get back.
+_retrieval_cache: "OrderedDict[Tuple[str, str, int], Dict[str, List[List]]]" = OrderedDict()
+_retrieval_cache_lock = threading.Lock()
+
+def _cache_get(key: Tuple[str, str, int]) -> Optional[Dict[str, List[List]]]:
+    with _retrieval_cache_lock:
+        if key in _retrieval_cache:
+            _retrieval_cache.move_to_end(key)
+            return copy.deepcopy(_retrieval_cache[key])
+    return None
+
+def _cache_put(key: Tuple[str, str, int], result: Dict[str, List[List]]):
+    with _retrieval_cache_lock:
+        _retrieval_cache[key] = copy.deepcopy(result)
+        if len(_retrieval_cache) > RETRIEVAL_CACHE_SIZE:
+            _retrieval_cache.popitem(last=False)
+
 def retrieve_documents(collection, query: str, n_results: int = 3) -> Dict[str, List[List]]:
     """
     Perform semantic retrieval from ChromaDB.
     Returns dict with 'documents' and 'metadatas' lists.
     """
+    return retrieve_documents_batch(collection, [query], n_results)[0]
+
+def retrieve_documents_batch(collection, queries: List[str], n_results: int = 3) -> List[Dict[str, List[List]]]:
+    """
+    Retrieve documents for many queries with a single ChromaDB call, so the
+    query embeddings are computed in one batch.
+    Returns one dict per query, shaped like retrieve_documents' result.
+    """
+    results: List[Optional[Dict[str, List[List]]]] = [
+        _cache_get((str(collection.id), query, n_results)) for query in queries
+    ]
+    missing = [i for i, result in enumerate(results) if result is None]
+    if not missing:
+        return results
+
     try:
-        results = collection.query(
-            query_texts=[query],
+        response = collection.query(
+            query_texts=[queries[i] for i in missing],
             n_results=n_results
         )
-        documents = results.get("documents", [[]])
-        metadatas = results.get("metadatas", [[]])
-
-        # Ensure lists exist
-        if not documents:
-            documents = [[]]
-        if not metadatas:
-            metadatas = [[]]
-
-        return {"documents": documents, "metadatas": metadatas}
+        documents = response.get("documents") or []
+        metadatas = response.get("metadatas") or []
+
+        for pos, i in enumerate(missing):
+            # Ensure lists exist
+            result = {
+                "documents": [documents[pos] if pos < len(documents) else []],
+                "metadatas": [metadatas[pos] if pos < len(metadatas) else []]
+            }
+            _cache_put((str(collection.id), queries[i], n_results), result)
+            results[i] = result
 
     except Exception as e:
         print(f"⚠️ Error during document retrieval: {e}")
-        return {"documents": [[]], "metadatas": [[]]}
+        for i in missing:
+            results[i] = {"documents": [[]], "metadatas": [[]]}
+
+    return results
 
 # ------------------ CONTEXT FORMATTING ------------------
 
@@ -85,11 +171,13 @@ def format_context(documents: List[str], metadatas: List[Dict]) -> str:
     """
     Combine retrieved documents into a single context string with source attributions.
     """
-    context_list = []
-
-    for i, doc in enumerate(documents):
-        meta = metadatas[i] if i < len(metadatas) else {}
-        source = meta.get("source", f"DOC_{i+1}")
-        context_list.append(f"[{source}]\n{doc}")
-
+    sources = tuple(
+        ((metadatas[i] if i < len(metadatas) else None) or {}).get("source", f"DOC_{i+1}")
+        for i in range(len(documents))
+    )
+    return _format_context_cached(tuple(documents), sources)
+
+@functools.lru_cache(maxsize=512)
+def _format_context_cached(documents: Tuple[str, ...], sources: Tuple[str, ...]) -> str:
+    context_list = [f"[{source}]\n{doc}" for doc, source in zip(documents, sources)]
     return "\n\n".join(context_list)
@@ -3,6 +3,7 @@ from ragas.embeddings import LangchainEmbeddingsWrapper
 from langchain_openai import ChatOpenAI
 from langchain_openai import OpenAIEmbeddings
 from typing import Dict, List, Optional
+import asyncio
 
 # RAGAS imports
 try:
@@ -13,11 +14,19 @@ try:
 except ImportError:
     RAGAS_AVAILABLE = False
 
-def evaluate_response_quality(question: str, answer: str, contexts: List[str]) -> Dict[str, float]:
-    """Evaluate response quality using RAGAS metrics"""
-    if not RAGAS_AVAILABLE:
-        return {"error": "RAGAS not available"}
-    
+# Columns every evaluation sample has; there is no ground-truth reference
+SAMPLE_COLUMNS = {"user_input", "response", "retrieved_contexts"}
+
+def _can_score(metric) -> bool:
+    """True if the sample provides every column the metric requires"""
+    required = getattr(metric, "required_columns", {}).get("SINGLE_TURN", set())
+    return set(required) <= SAMPLE_COLUMNS
+
+def build_metrics() -> List:
+    """
+    Create the RAGAS metric instances used for evaluation, keeping only
+    those that can run on our samples (e.g. not reference-based ones).
+    """
     # TODO: Create evaluator LLM with model gpt-3.5-turbo
     evaluator_llm = LangchainLLMWrapper(
     ChatOpenAI(
@@ -41,6 +50,15 @@ def evaluate_response_quality(question: str, answer: str, contexts: List[str]) -
         BleuScore()
     ]
 
+    return [metric for metric in metrics if _can_score(metric)]
+
+def evaluate_response_quality(question: str, answer: str, contexts: List[str]) -> Dict[str, float]:
+    """Evaluate response quality using RAGAS metrics"""
+    if not RAGAS_AVAILABLE:
+        return {"error": "RAGAS not available"}
+
+    metrics = build_metrics()
+
     # TODO: Evaluate the response using the metrics
     sample = SingleTurnSample(
         user_input=question,
@@ -62,3 +80,36 @@ def evaluate_response_quality(question: str, answer: str, contexts: List[str]) -
             scores[metric_name] = float(result[metric_name][0])
 
     return scores
+
+async def aevaluate_response_quality(question: str, answer: str, contexts: List[str],
+                                     metrics: Optional[List] = None) -> Dict[str, float]:
+    """
+    Evaluate response quality, scoring every RAGAS metric concurrently.
+    Pass metrics from build_metrics() to reuse instances prepared earlier.
+    """
+    if not RAGAS_AVAILABLE:
+        return {"error": "RAGAS not available"}
+
+    metrics = metrics or build_metrics()
+
+    sample = SingleTurnSample(
+        user_input=question,
+        response=answer,
+        retrieved_contexts=contexts
+    )
+
+    results = await asyncio.gather(
+        *[metric.single_turn_ascore(sample) for metric in metrics],
+        return_exceptions=True
+    )
+
+    scores = {}
+
+    for metric, result in zip(metrics, results):
+        metric_name = metric.__class__.__name__
+        if isinstance(result, Exception):
+            scores[f"{metric_name}_error"] = str(result)
+        else:
+            scores[metric_name] = float(result)
+
+    return scores